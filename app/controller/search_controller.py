@@ -2,18 +2,29 @@ from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
 from app.service.embedding_service import (
+    decode_image,
     fetch_image,
+    fetch_image_async,
+    fetch_images_async,
     get_image_embedding,
+    get_image_embeddings_batch,
     get_text_embedding,
 )
-from app.service.pinecone_service import upsert_embedding, query_similar_products
-from io import BytesIO
-from PIL import Image
+from app.service.pinecone_service import (
+    upsert_embeddings_batch,
+    query_similar_products,
+)
+import asyncio
+import logging
+import numpy as np
 
 
 router = APIRouter()
 
-router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# In-flight /text-search work keyed by (query, top_k), shared by concurrent callers
+_inflight_text_searches: dict[tuple[str, int], asyncio.Task] = {}
 
 
 # ✅ Define product schema
@@ -28,27 +39,52 @@ class ProductRequest(BaseModel):
 
 
 @router.post("/embed-products")
-def embed_multiple_products(req: List[ProductRequest]):
+async def embed_multiple_products(req: List[ProductRequest]):
     """
     Generate and store image + text embeddings for multiple products.
     Returns a detailed summary for success and failures.
     """
     success, failed = [], []
 
-    for product in req:
-        try:
-            # Step 1️⃣ Fetch and embed image
-            pil_image = fetch_image(product.imageUrl)
-            image_emb = get_image_embedding(pil_image)
+    # Step 1️⃣ Fetch all product images concurrently
+    images = await fetch_images_async([product.imageUrl for product in req])
 
-            # Step 2️⃣ Generate text embedding
+    fetched = []
+    for product, image in zip(req, images):
+        if isinstance(image, Exception):
+            failed.append(
+                {
+                    "product_name": product.name,
+                    "error": str(image),
+                }
+            )
+        else:
+            fetched.append((product, image))
+
+    # Step 2️⃣ Embed all images in a single batched forward pass
+    try:
+        image_embs = await asyncio.to_thread(
+            get_image_embeddings_batch, [pil_image for _, pil_image in fetched]
+        )
+    except Exception as e:
+        failed.extend(
+            {"product_name": product.name, "error": str(e)} for product, _ in fetched
+        )
+        fetched, image_embs = [], []
+
+    image_vectors, text_vectors, prepared = [], [], []
+
+    for (product, _), image_emb in zip(fetched, image_embs):
+        try:
+            # Step 3️⃣ Generate text embedding
             text_input = (
                 f"{product.name}. {product.description}. "
                 f"Category: {product.category}. Brand: {product.brand or ''}. Price: {product.price or ''}."
             )
-            text_emb = get_text_embedding(text_input)
+            text_emb = await asyncio.to_thread(get_text_embedding, text_input)
 
-            # Step 3️⃣ Prepare metadata
+            # Step 4️⃣ Prepare metadata (shared by both vectors — the index
+            # already separates image from text, so no per-type copy)
             product_id = product.productId or product.name.lower().replace(" ", "_")
             metadata = {
                 "product_id": product_id,
@@ -57,29 +93,21 @@ def embed_multiple_products(req: List[ProductRequest]):
                 "category": product.category
             }
 
-            # Step 4️⃣ Store image embedding
-            upsert_embedding(
-                product_id=f"{product_id}_img",
-                embedding=image_emb,
-                metadata={**metadata, "type": "image"},
-                index_type="image",
-            )
-
-            # Step 5️⃣ Store text embedding
-            upsert_embedding(
-                product_id=f"{product_id}_txt",
-                embedding=text_emb,
-                metadata={**metadata, "type": "text"},
-                index_type="text",
+            image_vectors.append(
+                {
+                    "product_id": f"{product_id}_img",
+                    "embedding": image_emb,
+                    "metadata": metadata,
+                }
             )
-
-            success.append(
+            text_vectors.append(
                 {
-                    "product_id": product_id,
-                    "status": "success",
-                    "stored_types": ["image", "text"],
+                    "product_id": f"{product_id}_txt",
+                    "embedding": text_emb,
+                    "metadata": metadata,
                 }
             )
+            prepared.append((product, product_id))
 
         except Exception as e:
             failed.append(
@@ -89,6 +117,24 @@ def embed_multiple_products(req: List[ProductRequest]):
                 }
             )
 
+    # Step 5️⃣ Store image + text embeddings with batched upserts
+    try:
+        await asyncio.to_thread(upsert_embeddings_batch, image_vectors, "image")
+        await asyncio.to_thread(upsert_embeddings_batch, text_vectors, "text")
+
+        success.extend(
+            {
+                "product_id": product_id,
+                "status": "success",
+                "stored_types": ["image", "text"],
+            }
+            for _, product_id in prepared
+        )
+    except Exception as e:
+        failed.extend(
+            {"product_name": product.name, "error": str(e)} for product, _ in prepared
+        )
+
     # Step 6️⃣ Build final response
     return {
         "status": True if success else False,
@@ -124,7 +170,7 @@ async def similar_product_image_search(
         if file and file.filename.strip() != "":
             try:
                 image_bytes = await file.read()
-                pil_image = Image.open(BytesIO(image_bytes)).convert("RGB")
+                pil_image = await asyncio.to_thread(decode_image, image_bytes)
                 source = "file"
             except Exception as e:
                 raise HTTPException(
@@ -132,7 +178,7 @@ async def similar_product_image_search(
                 )
         else:
             try:
-                pil_image = fetch_image(image_url)
+                pil_image = await asyncio.to_thread(fetch_image, image_url)
                 source = "url"
             except Exception as e:
                 raise HTTPException(
@@ -140,11 +186,15 @@ async def similar_product_image_search(
                 )
 
         # ✅ Step 3: Generate embedding
-        embedding = get_image_embedding(pil_image)
+        embedding = await asyncio.to_thread(get_image_embedding, pil_image)
 
         # ✅ Step 4: Query Pinecone for similar products
-        results = query_similar_products(
-            query_embedding=embedding, top_k=top_k, filters=None, index_type="image"
+        results = await asyncio.to_thread(
+            query_similar_products,
+            query_embedding=embedding,
+            top_k=top_k,
+            filters=None,
+            index_type="image",
         )
 
         return {
@@ -175,11 +225,8 @@ async def similar_product_text_search(query: str = Form(...), top_k: int = Form(
         if not query or not query.strip():
             raise HTTPException(status_code=400, detail="Query cannot be empty.")
 
-        embedding = get_text_embedding(query)
-
-        results = query_similar_products(
-            query_embedding=embedding, top_k=top_k, filters=None, index_type="text"
-        )
+        # ✅ Step 2: Embed + search (identical concurrent queries share one call)
+        results = await _coalesced_text_search(query, top_k)
 
         return {
             "status": True,
@@ -212,37 +259,50 @@ async def get_recommendations(
         # ✅ Build base metadata filter — exclude the same product
         filters = {"product_id": {"$ne": product_id}}
 
-        combined_results = []
-
-        # ✅ 1️⃣ IMAGE-based recommendations
-        if mode in ("image", "hybrid") and image_url:
+        async def image_recommendations():
             try:
-                pil_image = fetch_image(image_url)
-                image_emb = get_image_embedding(pil_image)
-                image_results = query_similar_products(
+                pil_image = await fetch_image_async(image_url)
+                image_emb = await asyncio.to_thread(get_image_embedding, pil_image)
+                return await asyncio.to_thread(
+                    query_similar_products,
                     query_embedding=image_emb,
                     top_k=top_k,
-                    filters={"type": {"$eq": "image"}, **filters},
+                    filters=filters,
                     index_type="image",
                 )
-                combined_results.extend(image_results)
             except Exception as e:
-                print(f"⚠️ Image recommendation failed: {e}")
+                logger.warning("⚠️ Image recommendation failed: %s", e)
+                return []
 
-        # ✅ 2️⃣ TEXT-based recommendations
-        if mode in ("text", "hybrid") and (product_name or description):
+        async def text_recommendations():
             try:
                 text_input = f"{product_name or ''}. {description or ''}".strip()
-                text_emb = get_text_embedding(text_input)
-                text_results = query_similar_products(
+                text_emb = await asyncio.to_thread(get_text_embedding, text_input)
+                return await asyncio.to_thread(
+                    query_similar_products,
                     query_embedding=text_emb,
                     top_k=top_k,
-                    filters={"type": {"$eq": "text"}, **filters},
+                    filters=filters,
                     index_type="text",
                 )
-                combined_results.extend(text_results)
             except Exception as e:
-                print(f"⚠️ Text recommendation failed: {e}")
+                logger.warning("⚠️ Text recommendation failed: %s", e)
+                return []
+
+        tasks = []
+
+        # ✅ 1️⃣ IMAGE-based recommendations
+        if mode in ("image", "hybrid") and image_url:
+            tasks.append(image_recommendations())
+
+        # ✅ 2️⃣ TEXT-based recommendations
+        if mode in ("text", "hybrid") and (product_name or description):
+            tasks.append(text_recommendations())
+
+        # Run both modalities concurrently (embedding + Pinecone query each)
+        combined_results = [
+            item for results in await asyncio.gather(*tasks) for item in results
+        ]
 
         if not combined_results:
             raise HTTPException(status_code=404, detail="No recommendations found.")
@@ -270,11 +330,47 @@ def _deduplicate_and_rank(results):
     Deduplicate products by ID and rank by score (descending).
     If same product appears from both text & image, keep the best score.
     """
-    merged = {}
-    for item in results:
-        pid = item["product_id"]
-        score = item["score"]
-        if pid not in merged or score > merged[pid]["score"]:
-            merged[pid] = item
-
-    return sorted(merged.values(), key=lambda x: x["score"], reverse=True)
+    if not results:
+        return []
+
+    ids = np.array([item["product_id"] for item in results])
+    scores = np.array([item["score"] for item in results], dtype=np.float64)
+
+    # Stable descending sort, then keep the first (best) hit per product_id
+    order = np.argsort(-scores, kind="stable")
+    _, first = np.unique(ids[order], return_index=True)
+
+    return [results[i] for i in order[np.sort(first)]]
+
+
+async def _text_search(query: str, top_k: int):
+    embedding = await asyncio.to_thread(get_text_embedding, query)
+    return await asyncio.to_thread(
+        query_similar_products,
+        query_embedding=embedding,
+        top_k=top_k,
+        filters=None,
+        index_type="text",
+    )
+
+
+async def _coalesced_text_search(query: str, top_k: int):
+    """
+    Singleflight: concurrent identical searches await the same task
+    instead of each hitting Gemini + Pinecone.
+    """
+    key = (query, top_k)
+    task = _inflight_text_searches.get(key)
+    if task is None:
+        task = asyncio.create_task(_text_search(query, top_k))
+        _inflight_text_searches[key] = task
+
+        def _done(finished: asyncio.Task):
+            _inflight_text_searches.pop(key, None)
+            if not finished.cancelled():
+                finished.exception()  # retrieved even if every caller went away
+
+        task.add_done_callback(_done)
+
+    # Shield so one client disconnecting doesn't cancel the shared search
+    return await asyncio.shield(task)
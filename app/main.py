@@ -1,12 +1,36 @@
+import logging
+import os
+from contextlib import asynccontextmanager
+
+# Configure logging before the services load (they log model / index setup).
+# Per-request details are DEBUG, so production (INFO) skips formatting them.
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from app.controller import search_controller
+from app.service.embedding_service import close_http_session
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Release pooled HTTP connections on shutdown
+    await close_http_session()
+
 
 # Initialize FastAPI app
+# The Dockerfile runs this app with uvicorn --loop uvloop --http httptools.
 app = FastAPI(
     title="AI Product Search Service",
     description="E-commerce visual + semantic search backend powered by Pinecone & Gemini",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,  # faster JSON for float-heavy results
 )
 
 # Enable CORS (optional — useful for frontend integration)
@@ -0,0 +1,126 @@
+# cache_service.py
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+import numpy as np
+import redis
+from dotenv import load_dotenv
+
+# Load env vars
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", 7 * 24 * 60 * 60))
+LOCAL_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 1024))
+# After a Redis error, skip Redis for this long instead of paying its timeouts
+REDIS_BACKOFF_SECONDS = float(os.getenv("EMBEDDING_CACHE_REDIS_BACKOFF", 30))
+
+# Redis is optional — without REDIS_URL only the in-process LRU is used
+_redis = (
+    redis.Redis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    if REDIS_URL
+    else None
+)
+
+_redis_disabled_until = 0.0
+
+_local_cache: OrderedDict = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def _redis_available() -> bool:
+    return _redis is not None and time.monotonic() >= _redis_disabled_until
+
+
+def _redis_failed(action: str, error: Exception):
+    global _redis_disabled_until
+    _redis_disabled_until = time.monotonic() + REDIS_BACKOFF_SECONDS
+    logger.warning(
+        "⚠️ Embedding cache %s failed, skipping Redis for %.0fs: %s",
+        action,
+        REDIS_BACKOFF_SECONDS,
+        error,
+    )
+
+
+def embedding_cache_key(kind: str, dim: int, model: str, payload: bytes) -> str:
+    """
+    Build a cache key partitioned by modality, embedding size and model,
+    e.g. emb:text:768:text-embedding-004:<sha256>.
+    Including the model means a model upgrade never serves stale vectors.
+    """
+    return f"emb:{kind}:{dim}:{model}:{hashlib.sha256(payload).hexdigest()}"
+
+
+def get_cached_embedding(key: str):
+    with _local_lock:
+        if key in _local_cache:
+            _local_cache.move_to_end(key)
+            return _local_cache[key]
+
+    if not _redis_available():
+        return None
+
+    try:
+        raw = _redis.get(key)
+    except redis.RedisError as e:
+        _redis_failed("read", e)
+        return None
+
+    if raw is None:
+        return None
+
+    embedding = np.frombuffer(raw, dtype=np.float32)
+    _store_local(key, embedding)
+    return embedding
+
+
+def set_cached_embedding(key: str, embedding, ttl: int = EMBEDDING_CACHE_TTL):
+    _store_local(key, embedding)
+
+    if not _redis_available():
+        return
+
+    try:
+        _redis.setex(
+            key, ttl, np.asarray(embedding, dtype=np.float32).tobytes()
+        )
+    except redis.RedisError as e:
+        _redis_failed("write", e)
+
+
+def _store_local(key: str, embedding):
+    with _local_lock:
+        _local_cache[key] = embedding
+        _local_cache.move_to_end(key)
+        while len(_local_cache) > LOCAL_CACHE_SIZE:
+            _local_cache.popitem(last=False)
+
+
+def cached_embedding(
+    kind: str, dim: int, model: str, to_bytes, ttl: int = EMBEDDING_CACHE_TTL
+):
+    """
+    Cache a single-argument embedding function by the content hash of its input.
+    `to_bytes` turns the input (text, image, ...) into the bytes that get hashed.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(value):
+            key = embedding_cache_key(kind, dim, model, to_bytes(value))
+            embedding = get_cached_embedding(key)
+            if embedding is None:
+                embedding = func(value)
+                set_cached_embedding(key, embedding, ttl)
+            return embedding
+
+        return wrapper
+
+    return decorator
@@ -1,59 +1,256 @@
 # embedding_service.py
 from sentence_transformers import SentenceTransformer
+import torch
 from PIL import Image
+import asyncio
+import aiohttp
+import base64
+import hashlib
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from io import BytesIO
 import os
+import logging
 from google import generativeai as genai
 from dotenv import load_dotenv
+from app.service.cache_service import cached_embedding
 
 # Load env vars
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # 1️⃣ Configure Gemini once globally
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 if not GOOGLE_API_KEY:
     raise ValueError("❌ Missing GOOGLE_API_KEY in .env")
 genai.configure(api_key=GOOGLE_API_KEY)
 
+TEXT_EMBEDDING_MODEL = "text-embedding-004"
+# Product copy and popular queries repeat a lot; keep their embeddings for a day
+TEXT_EMBEDDING_CACHE_TTL = int(os.getenv("TEXT_EMBEDDING_CACHE_TTL", 24 * 60 * 60))
+
 # 2️⃣ Load SigLIP / CLIP image model globally once
 # (SigLIP may fail under SentenceTransformer, so CLIP is stable)
-image_model = SentenceTransformer("clip-ViT-B-32")
-print("✅ Loaded image embedding model: clip-ViT-B-32")
+# When IMAGE_EMBEDDING_URL points at an embedding server (TEI-style /embed),
+# inference runs there and no model is loaded in-process.
+IMAGE_EMBEDDING_URL = os.getenv("IMAGE_EMBEDDING_URL")
+# Names the model for both paths (loaded locally, or served by the remote server)
+IMAGE_EMBEDDING_MODEL = os.getenv("IMAGE_EMBEDDING_MODEL", "clip-ViT-B-32")
+# Cache keys must not mix vectors from different backends sharing one Redis,
+# so remote embeddings are also scoped to the server they came from.
+IMAGE_EMBEDDING_CACHE_MODEL = (
+    f"{IMAGE_EMBEDDING_MODEL}@{hashlib.sha256(IMAGE_EMBEDDING_URL.encode()).hexdigest()[:12]}"
+    if IMAGE_EMBEDDING_URL
+    else IMAGE_EMBEDDING_MODEL
+)
+
+image_model = None
+if not IMAGE_EMBEDDING_URL:
+    IMAGE_MODEL_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+    image_model = SentenceTransformer(IMAGE_EMBEDDING_MODEL, device=IMAGE_MODEL_DEVICE)
+
+    # FP16 halves memory traffic on GPU; CPU kernels stay in FP32
+    if IMAGE_MODEL_DEVICE == "cuda":
+        image_model.half()
+
+    # Opt-in: compile the vision tower (first call pays the compile cost)
+    if os.getenv("CLIP_TORCH_COMPILE", "0") == "1":
+        clip_module = image_model[0].model
+        clip_module.vision_model = torch.compile(
+            clip_module.vision_model, mode="reduce-overhead"
+        )
+
+    # Warm-up pass so the first request doesn't pay lazy init / compile cost
+    image_model.encode(Image.new("RGB", (224, 224)), normalize_embeddings=True)
+    logger.info(
+        "✅ Loaded image embedding model: %s (%s)", IMAGE_EMBEDDING_MODEL, IMAGE_MODEL_DEVICE
+    )
+else:
+    logger.info(
+        "✅ Using remote image embedding server: %s (%s)",
+        IMAGE_EMBEDDING_URL,
+        IMAGE_EMBEDDING_MODEL,
+    )
+
+# 3️⃣ Pooled keep-alive HTTP session for blocking calls (image fetch, embed server)
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=2, backoff_factor=0.2),
+)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+# 4️⃣ Shared aiohttp session, created lazily inside the running event loop
+_http_session: aiohttp.ClientSession | None = None
+
+def _get_http_session() -> aiohttp.ClientSession:
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=64, ttl_dns_cache=300),
+            # Per-socket limits only: `total` would also count time spent queued
+            # for a pooled connection, failing the tail of large batches
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=10),
+        )
+    return _http_session
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
 
 # ======================================
 #  Image Embedding
 # ======================================
+# CLIP resizes the shorter side to 224 px; anything much larger is wasted pixel work
+MAX_IMAGE_SHORT_SIDE = 448
+
+def _to_rgb(img: Image.Image) -> Image.Image:
+    return img if img.mode == "RGB" else img.convert("RGB")
+
+def _shrink(img: Image.Image) -> Image.Image:
+    short_side = min(img.size)
+    if short_side <= MAX_IMAGE_SHORT_SIDE:
+        return img
+    scale = MAX_IMAGE_SHORT_SIDE / short_side
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+def decode_image(image_bytes: bytes) -> Image.Image:
+    """
+    Decode raw image bytes to an RGB PIL image, downscaled so the shorter
+    side is at most MAX_IMAGE_SHORT_SIDE.
+    Image.open enforces Pillow's decompression-bomb limit before any pixels
+    are decoded; Pillow's bundled libjpeg-turbo handles JPEGs.
+    Modes that can't be resampled (palette, 16-bit, CMYK, ...) are converted
+    to RGB before shrinking.
+    """
+    img = Image.open(BytesIO(image_bytes))
+    # JPEG only: let the decoder downscale by 1/2–1/8 during decoding
+    img.draft("RGB", (MAX_IMAGE_SHORT_SIDE, MAX_IMAGE_SHORT_SIDE))
+    # Only these modes resample safely; convert the rest (P, 1, I;16, CMYK, ...)
+    # first, since resize rejects some of them and smooths others poorly
+    if img.mode not in ("RGB", "RGBA", "L", "LA"):
+        img = img.convert("RGB")
+    return _to_rgb(_shrink(img))
+
 def fetch_image(image_url: str) -> Image.Image:
     try:
-        response = requests.get(image_url, timeout=10)
+        response = _session.get(image_url, timeout=10)
         response.raise_for_status()
-        return Image.open(BytesIO(response.content)).convert("RGB")
+        return decode_image(response.content)
+    except Exception as e:
+        raise ValueError(
+            f"❌ Failed to fetch image from URL: {type(e).__name__}: {e}"
+        )
+
+async def fetch_image_async(image_url: str) -> Image.Image:
+    try:
+        async with _get_http_session().get(image_url) as response:
+            response.raise_for_status()
+            content = await response.read()
+        return await asyncio.to_thread(decode_image, content)
     except Exception as e:
-        raise ValueError(f"❌ Failed to fetch image from URL: {e}")
+        raise ValueError(
+            f"❌ Failed to fetch image from URL: {type(e).__name__}: {e}"
+        )
+
+async def fetch_images_async(image_urls: list[str]) -> list:
+    """
+    Fetch several images concurrently.
+    Failed downloads are returned in place as exceptions instead of raising,
+    so callers can report them per item.
+    """
+    return await asyncio.gather(
+        *(fetch_image_async(url) for url in image_urls), return_exceptions=True
+    )
 
+def _image_cache_bytes(pil_image: Image.Image) -> bytes:
+    return f"{pil_image.mode}:{pil_image.size}:".encode() + pil_image.tobytes()
+
+def _image_to_base64(pil_image: Image.Image) -> str:
+    buffer = BytesIO()
+    pil_image.save(buffer, format="JPEG", quality=95)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+def _encode_images_remote(pil_images: list, batch_size: int) -> np.ndarray:
+    """
+    Send images to the embedding server; it batches concurrent requests
+    from all workers into shared GPU forward passes.
+    """
+    embeddings = []
+    for start in range(0, len(pil_images), batch_size):
+        chunk = pil_images[start:start + batch_size]
+        response = _session.post(
+            IMAGE_EMBEDDING_URL,
+            json={"inputs": [_image_to_base64(img) for img in chunk]},
+            timeout=30,
+        )
+        response.raise_for_status()
+        embeddings.extend(response.json())
+
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+def _encode_images(pil_images: list, batch_size: int = 32) -> np.ndarray:
+    if IMAGE_EMBEDDING_URL:
+        embeddings = _encode_images_remote(pil_images, batch_size)
+    else:
+        embeddings = image_model.encode(
+            pil_images,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+@cached_embedding("img", 512, IMAGE_EMBEDDING_CACHE_MODEL, _image_cache_bytes)
 def get_image_embedding(pil_image: Image.Image):
     try:
-        embedding = image_model.encode(pil_image, normalize_embeddings=True)
-        print(f"✅ Generated image embedding of length {len(embedding)}")
-        return embedding.tolist()
+        return _encode_images([pil_image])[0]
     except Exception as e:
         raise RuntimeError(f"❌ Failed to generate image embedding: {e}")
 
+def get_image_embeddings_batch(pil_images: list, batch_size: int = 32):
+    """
+    Encode several images in a single batched forward pass.
+    """
+    if not pil_images:
+        return []
+
+    try:
+        embeddings = _encode_images(pil_images, batch_size=batch_size)
+        logger.debug("✅ Generated %d image embeddings in batch", len(embeddings))
+        return list(embeddings)
+    except Exception as e:
+        raise RuntimeError(f"❌ Failed to generate image embeddings: {e}")
+
 # ======================================
 #  Text Embedding (Gemini)
 # ======================================
+@cached_embedding(
+    "text",
+    768,
+    TEXT_EMBEDDING_MODEL,
+    lambda text: (text or "").encode(),
+    ttl=TEXT_EMBEDDING_CACHE_TTL,
+)
 def get_text_embedding(text: str):
     if not text or not text.strip():
         raise ValueError("❌ Text input cannot be empty for embedding")
 
     try:
         response = genai.embed_content(
-            model="models/text-embedding-004",
+            model=f"models/{TEXT_EMBEDDING_MODEL}",
             content=text
         )
-        embedding = response["embedding"]
-        print(f"✅ Generated text embedding of length {len(embedding)}")
-        return embedding
+        return np.asarray(response["embedding"], dtype=np.float32)
     except Exception as e:
         raise RuntimeError(f"❌ Failed to get text embedding from Gemini: {e}")
@@ -1,17 +1,28 @@
 import os
-from pinecone import Pinecone, ServerlessSpec
+import hashlib
+import logging
+import numpy as np
+from pinecone import ServerlessSpec
+from pinecone.grpc import PineconeGRPC
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Pinecone client
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+logger = logging.getLogger(__name__)
+
+# Initialize Pinecone client (gRPC data plane: persistent HTTP/2 channel)
+pc = PineconeGRPC(api_key=os.getenv("PINECONE_API_KEY"))
 
 # Index names
 IMAGE_INDEX_NAME = os.getenv("PINECONE_IMAGE_INDEX", "ecom-fort-image-index")
 TEXT_INDEX_NAME = os.getenv("PINECONE_TEXT_INDEX", "ecom-fort-text-index")
 
+# Set PINECONE_ENSURE_INDEXES=0 in production where the indexes are provisioned
+ENSURE_INDEXES = os.getenv("PINECONE_ENSURE_INDEXES", "1") == "1"
+# Marker written once the indexes are known to exist, so restarted workers skip the check
+READY_SENTINEL = os.getenv("PINECONE_READY_SENTINEL", "/tmp/.pinecone_ready")
+
 # -------------------------------------------------------------
 # 🧠 Create indexes if they don't exist
 # -------------------------------------------------------------
@@ -19,7 +30,7 @@ def ensure_indexes_exist():
     existing_indexes = [i["name"] for i in pc.list_indexes()]
 
     if IMAGE_INDEX_NAME not in existing_indexes:
-        print(f"⚙️ Creating image index: {IMAGE_INDEX_NAME}")
+        logger.info("⚙️ Creating image index: %s", IMAGE_INDEX_NAME)
         pc.create_index(
             name=IMAGE_INDEX_NAME,
             dimension=512,  # SigLIP image embedding size
@@ -28,7 +39,7 @@ def ensure_indexes_exist():
         )
 
     if TEXT_INDEX_NAME not in existing_indexes:
-        print(f"⚙️ Creating text index: {TEXT_INDEX_NAME}")
+        logger.info("⚙️ Creating text index: %s", TEXT_INDEX_NAME)
         pc.create_index(
             name=TEXT_INDEX_NAME,
             dimension=768,  # Gemini text embedding size
@@ -36,10 +47,37 @@ def ensure_indexes_exist():
             spec=ServerlessSpec(cloud="aws", region="us-east-1")
         )
 
-    print("✅ Indexes ready.")
+    logger.info("✅ Indexes ready.")
+
+
+def _sentinel_content() -> str:
+    # Identify the project by a hash of the API key, so a new key/project with
+    # the same (default) index names is checked again
+    api_key = os.getenv("PINECONE_API_KEY") or ""
+    key_id = hashlib.sha256(api_key.encode()).hexdigest()
+    return f"{key_id}\n{IMAGE_INDEX_NAME}\n{TEXT_INDEX_NAME}"
+
+
+def _indexes_marked_ready() -> bool:
+    try:
+        with open(READY_SENTINEL) as f:
+            return f.read() == _sentinel_content()
+    except OSError:
+        return False
+
+
+def _mark_indexes_ready():
+    try:
+        with open(READY_SENTINEL, "w") as f:
+            f.write(_sentinel_content())
+    except OSError as e:
+        logger.warning("⚠️ Could not write index sentinel %s: %s", READY_SENTINEL, e)
+
 
-# Ensure both exist before usage
-ensure_indexes_exist()
+# Ensure both exist before usage (skipped when disabled or already verified)
+if ENSURE_INDEXES and not _indexes_marked_ready():
+    ensure_indexes_exist()
+    _mark_indexes_ready()
 
 # Connect to them
 IMAGE_INDEX = pc.Index(IMAGE_INDEX_NAME)
@@ -48,19 +86,51 @@ TEXT_INDEX = pc.Index(TEXT_INDEX_NAME)
 # -------------------------------------------------------------
 # 🚀 Core Functions
 # -------------------------------------------------------------
-def upsert_embedding(product_id: str, embedding: list, metadata: dict, index_type="image"):
+def _to_values(embedding) -> list:
+    """
+    Embeddings travel through the service as float32 arrays;
+    only convert to a plain list at the Pinecone boundary.
+    Values are deliberately not quantized: serverless indexes on SDK 5.0.1
+    have no float16/int8 dense vector type, and the gRPC client already
+    ships values as packed float32, so rounding would only cost precision.
+    """
+    return np.asarray(embedding, dtype=np.float32).tolist()
+
+
+def upsert_embedding(product_id: str, embedding, metadata: dict, index_type="image"):
     """
     Store a product embedding (image or text) in Pinecone.
     """
     index = IMAGE_INDEX if index_type == "image" else TEXT_INDEX
     vector = {
         "id": f"{index_type}-{product_id}",
-        "values": embedding,
+        "values": _to_values(embedding),
         "metadata": metadata,
     }
 
     index.upsert(vectors=[vector])
-    print(f"✅ Upserted {index_type} embedding for product {product_id}")
+    logger.debug("✅ Upserted %s embedding for product %s", index_type, product_id)
+
+
+def upsert_embeddings_batch(vectors: list, index_type="image", batch_size: int = 100):
+    """
+    Store many product embeddings in Pinecone, batch_size vectors per upsert call.
+    Each item is a dict with `product_id`, `embedding` and `metadata`.
+    """
+    index = IMAGE_INDEX if index_type == "image" else TEXT_INDEX
+    payload = [
+        {
+            "id": f"{index_type}-{v['product_id']}",
+            "values": _to_values(v["embedding"]),
+            "metadata": v["metadata"],
+        }
+        for v in vectors
+    ]
+
+    for start in range(0, len(payload), batch_size):
+        index.upsert(vectors=payload[start:start + batch_size])
+
+    logger.debug("✅ Upserted %d %s embeddings", len(payload), index_type)
 
 
 def clear_index(index_type="image"):
@@ -69,11 +139,11 @@ def clear_index(index_type="image"):
     """
     index = IMAGE_INDEX if index_type == "image" else TEXT_INDEX
     index.delete(delete_all=True)
-    print(f"🧹 Cleared all vectors in {index_type} index.")
+    logger.info("🧹 Cleared all vectors in %s index.", index_type)
 
 
 def query_similar_products(
-    query_embedding: list,
+    query_embedding,
     top_k: int = 10,
     filters:dict ={},
     index_type: str = "image"
@@ -90,7 +160,7 @@ def query_similar_products(
     try:
 
         response = index.query(
-            vector=query_embedding,
+            vector=_to_values(query_embedding),
             top_k=top_k,
             include_values=False,
             include_metadata=True,
@@ -99,26 +169,30 @@ def query_similar_products(
         
 
         matches = response.get("matches", [])
-        results = []
 
-        for match in matches:
-            score = float(match["score"])
-            normalized_score = round(score * 100, 2)  # 0–100 scale
+        scores = np.fromiter(
+            (match["score"] for match in matches), dtype=np.float64, count=len(matches)
+        )
+        scores = np.round(scores * 100, 2)  # 0–100 scale
 
-            results.append({
-                "product_id": match["id"],
-                "score": normalized_score,
-                "metadata": match.get("metadata", {}),
-            })
+        # Sort by score descending (stable, so ties keep Pinecone's order)
+        order = np.argsort(-scores, kind="stable")
 
-        # Sort by score descending
-        results.sort(key=lambda x: x["score"], reverse=True)
+        results = [
+            {
+                "product_id": matches[i]["id"],
+                "score": score,
+                # gRPC sets metadata=None on vectors without any
+                "metadata": matches[i].get("metadata") or {},
+            }
+            for i, score in zip(order.tolist(), scores[order].tolist())
+        ]
 
-        print(f"✅ Found {len(results)} similar products ({index_type})")
+        logger.debug("✅ Found %d similar products (%s)", len(results), index_type)
 
         return results
 
     except Exception as e:
-        print(f"❌ Pinecone query failed for {index_type}: {e}")
+        logger.error("❌ Pinecone query failed for %s: %s", index_type, e)
         return []
 